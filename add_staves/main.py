@@ -1,12 +1,10 @@
-import os
-import re
-from dataclasses import dataclass
-from functools import reduce
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Annotated, List, Optional, Tuple
 
 import typer
 from pypdf import PageObject, PaperSize, PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
 from rich import print
 
 # The CLI app
@@ -16,8 +14,23 @@ app = typer.Typer(rich_markup_mode="rich", add_completion=False)
 # needs to be updated manually
 __version__ = "0.2.4"
 
+# The dimensions of a DIN A4 page
+_A4_WIDTH = float(PaperSize.A4.width)
+_A4_HEIGHT = float(PaperSize.A4.height)
 
-@dataclass
+# The directory of the bundled resources
+_RESOURCES = Path(__file__).parent / "resources"
+
+# The empty staves from the resources, indexed by the
+# number of staves (0...6). They are parsed once on import
+# instead of on every invocation.
+_STAVES: Tuple[PageObject, ...] = tuple(
+    PdfReader(_RESOURCES / ("empty-%d.pdf" % count), strict=False).pages[0]
+    for count in range(7)
+)
+
+
+@dataclass(slots=True)
 class PageLayout:
     """
     Convenience class that wraps the page configuration options
@@ -32,19 +45,20 @@ class PageLayout:
     ragged_bottom: bool
     ragged_bottom_last: bool
     horizontal_shift: int
-    minimum_height: float = PaperSize.A4.height
+    minimum_height: float = _A4_HEIGHT
     left_margin: int = 30
     right_margin: int = 30
 
-    def calculate_stave_height(self) -> float:
-        return self.stave_height + self.bottom_padding + self.top_padding
+    # derived from the options above in `__post_init__`
+    stave_total: float = field(init=False)
+    printable_width: float = field(init=False)
 
-    @property
-    def printable_width(self) -> float:
-        """
-        Calculates the width of the printable area.
-        """
-        return PaperSize.A4.width - self.left_margin - self.right_margin
+    def __post_init__(self):
+        # the height of a stave including its paddings
+        self.stave_total = self.stave_height + self.bottom_padding + self.top_padding
+
+        # the width of the printable area
+        self.printable_width = _A4_WIDTH - self.left_margin - self.right_margin
 
 
 def version_callback(value: bool):
@@ -89,20 +103,15 @@ def groups_parser(input: Optional[str]) -> Optional[List[int]]:
         return None
 
     try:
-        numbers = [int(num) for num in input.split(",")]
-    except:
+        numbers = [int(num) for num in input.replace(",", " ").split()]
+    except ValueError:
         numbers = []
 
-    try:
-        numbers = [int(num) for num in re.split(r"\s+", input)]
-    except:
-        pass
-
     return numbers if all(num > 0 for num in numbers) else []
 
 
 # def groups_callback(ctx: typer.Context, input: Optional[List[int]]) -> Optional[List[int]]:
-def groups_callback(score: PdfReader, groups: Optional[List[int]]) -> Optional[List[int]]:
+def groups_callback(page_count: int, groups: Optional[List[int]]) -> Optional[List[int]]:
     """
     🚨 No access to the score argument in the params.
 
@@ -125,21 +134,21 @@ def groups_callback(score: PdfReader, groups: Optional[List[int]]) -> Optional[L
     if groups is None:
         return None
 
-    # number of pages in total
-    page_count = len(score.pages)
-
     # sum of total grouped pages
     grouped_pages_count = sum(groups)
 
-    if sum(groups) == 0:
+    if grouped_pages_count == 0:
         return [page_count]
     elif grouped_pages_count < page_count:
         return groups + [page_count - grouped_pages_count]
     elif grouped_pages_count > page_count:
-        while sum(groups) > page_count:
-            groups.pop()
-        else:
-            return groups + [page_count - sum(groups)]
+        # discard the overflow while keeping track of the sum
+        while grouped_pages_count > page_count:
+            grouped_pages_count -= groups.pop()
+
+        if grouped_pages_count == page_count:
+            return groups
+        return groups + [page_count - grouped_pages_count]
     else:
         return groups
 
@@ -150,38 +159,109 @@ def staves_parser(staves_count: int) -> PageObject:
 
     Valid counts are 0...6
     """
-    staves_path = os.path.join(
-        os.path.dirname(__file__), "resources", "empty-%d.pdf" % int(staves_count)
+    # reject counts without a matching resource
+    staves_count = int(staves_count)
+    if not 0 <= staves_count < len(_STAVES):
+        raise typer.BadParameter("Valid counts are 0...6")
+
+    return _STAVES[staves_count]
+
+
+def create_staves_stamp(staves: PageObject, writer: PdfWriter) -> PageObject:
+    """
+    Wrap the staves in a Form XObject of the writer and return
+    a page of the same size that only draws this XObject.
+
+    Merging the stamp instead of the staves themselves references
+    the same drawing from every system rather than copying it.
+    """
+    form = DecodedStreamObject()
+    form.set_data(staves.get_contents().get_data())
+    form[NameObject("/Type")] = NameObject("/XObject")
+    form[NameObject("/Subtype")] = NameObject("/Form")
+    form[NameObject("/BBox")] = staves.cropbox
+    form[NameObject("/Resources")] = staves["/Resources"].get_object().clone(writer)
+
+    content = DecodedStreamObject()
+    content.set_data(b"/Staves Do")
+
+    stamp = PageObject.create_blank_page(
+        width=staves.cropbox.width, height=staves.cropbox.height
+    )
+    stamp.mediabox = staves.cropbox
+
+    # 🚨 `_add_object` is private API of pypdf: the form has to be an
+    # indirect object of the writer and pypdf offers no public way to
+    # register one. Check this call when upgrading pypdf.
+    stamp[NameObject("/Resources")] = DictionaryObject(
+        {
+            NameObject("/XObject"): DictionaryObject(
+                {NameObject("/Staves"): writer._add_object(form)}
+            )
+        }
     )
-    return PdfReader(staves_path).pages[0]
+    stamp.replace_contents(content)
+    return stamp
 
 
-def calculate_min_height(systems: List[PageObject], page_layout: PageLayout) -> float:
+def calculate_min_height(heights: List[float], page_layout: PageLayout) -> float:
     """
     Calculate the minimum height necessary to fit all systems
-    plus staves and whitespace on one page.
+    with the given heights plus staves and whitespace on one page.
     """
     return (
-        reduce(
-            lambda x, y: x + y, list(map(lambda system: system.cropbox.height, systems)), 0
-        )
+        sum(heights)
         + page_layout.top_margin
         + page_layout.bottom_margin
-        + len(systems)
-        * (page_layout.stave_height + page_layout.top_padding + page_layout.bottom_padding)
+        + len(heights) * page_layout.stave_total
     )
 
 
+def fit_groups(heights: List[float], page_layout: PageLayout) -> List[int]:
+    """
+    Group the systems with the given heights so that as many as
+    possible fit on a DIN A4 page including their staves.
+
+    The last, incomplete group is not part of the result. It is
+    added by `groups_callback`.
+    """
+    stave_height = page_layout.stave_total
+    margins = page_layout.top_margin + page_layout.bottom_margin
+    minimum_height = page_layout.minimum_height
+
+    height = margins
+    current_group_size = 0
+    groups = []
+    for system_height in heights:
+        new_height = system_height + stave_height
+
+        if height + new_height <= minimum_height:
+            current_group_size += 1
+            height += new_height
+        elif current_group_size == 0:
+            groups.append(1)
+            height = margins
+        else:
+            groups.append(current_group_size)
+            height = margins
+            current_group_size = 1
+
+    return groups
+
+
 def layout_systems(
     systems: List[PageObject],
     staves: PageObject,
-    writer: PdfWriter,
     page_layout: PageLayout,
     is_last_page: bool
-):
+) -> PageObject:
     """
     Layout the systems with the empty staves on a new blank
-    page in the writer.
+    page and return it.
+
+    The page doesn't depend on any other page, so it should only
+    be added to the writer once it is complete. Otherwise the writer
+    keeps the intermediate content of every merge.
 
     Dynamically adjust the paddings if the total space needed
     is less than a DIN A4 page as long as the flag `ragged_bottom`
@@ -190,20 +270,19 @@ def layout_systems(
     Respect the flag `ragged_bottom_last` to not adjust the paddings
     if set.
     """
-    # minimum height necessary to layout all elements
-    minimum_height = calculate_min_height(systems, page_layout)
+    # resolve the cropboxes of the systems only once
+    cropped_systems = [
+        (system, system.cropbox.height, system.cropbox.top) for system in systems
+    ]
 
-    # flag to dynamically layout the elements
-    # true if minimus_height is smaller and `ragged_bottom` is not set
-    dynamic_layout = True \
-    if minimum_height < PaperSize.A4.height and not page_layout.ragged_bottom \
-    else False
+    # minimum height necessary to layout all elements
+    minimum_height = calculate_min_height(
+        [system_height for _, system_height, _ in cropped_systems], page_layout
+    )
 
-    # Overwrite dynamic_layout in case it is the last page
-    if is_last_page:
-        dynamic_layout = True \
-        if minimum_height < PaperSize.A4.height and not page_layout.ragged_bottom_last \
-        else False
+    # flag to set the elements at their natural spacing
+    # `ragged_bottom_last` takes precedence on the last page
+    ragged = page_layout.ragged_bottom_last if is_last_page else page_layout.ragged_bottom
 
     # property height that represents the current level
     # to which the page is filled
@@ -215,26 +294,26 @@ def layout_systems(
     )
 
     # the page to which to "# print" the elements
-    current_page = writer.add_blank_page(PaperSize.A4.width, height)
+    current_page = PageObject.create_blank_page(width=_A4_WIDTH, height=height)
 
     # insert the top_margin
     height -= page_layout.top_margin
 
     # space that needs to be dynamically allocated
-    # this is only interesting if the flag dynamic_layout is set
+    # this is only interesting if minimum_height is smaller and
+    # the page is not ragged
     dynamic_spacing = (
-        page_layout.minimum_height
+        0
+        if ragged or minimum_height >= _A4_HEIGHT
+        else page_layout.minimum_height
         - minimum_height
         - page_layout.bottom_margin
         - page_layout.top_margin
-        if dynamic_layout
-        else 0
     )
 
     # calculate the additional_bottom_padding
-    additional_bottom_padding = dynamic_spacing / (3 * len(systems))
-    if additional_bottom_padding > 30:
-        additional_bottom_padding = 30
+    # 1/3 of the dynamic_spacing up to max 30
+    additional_bottom_padding = min(dynamic_spacing / (3 * len(systems)), 30)
 
     # remove the sum of the additional_bottom_paddings from the dynamic_spacing
     dynamic_spacing -= additional_bottom_padding * len(systems)
@@ -242,33 +321,41 @@ def layout_systems(
     # calculate the additional_top_padding
     additional_top_padding = dynamic_spacing / len(systems)
 
+    # the dimensions of the staves are the same for every system
+    staves_height = staves.cropbox.height
+    staves_x = (_A4_WIDTH - staves.cropbox.width) / 2
+
+    # layout ends up beeing too far to the right
+    # (PaperSize.A4.width - system.cropbox.width) / 2,
+    system_x = 0 + page_layout.horizontal_shift
+
+    # the paddings are the same for every system
+    bottom_padding = page_layout.bottom_padding + additional_bottom_padding
+    top_padding = page_layout.top_padding + additional_top_padding
+
+    # merge the elements with plain translation matrices
+    # instead of building a `Transformation` for every merge
+    merge = current_page.merge_transformed_page
+
     # iterate over the systems and add them to the current_page
-    for system in systems:
+    for system, system_height, system_top in cropped_systems:
         # add the system
-        current_page.merge_translated_page(
-            system,
-            # layout ends up beeing too far to the right
-            # (PaperSize.A4.width - system.cropbox.width) / 2,
-            0 + page_layout.horizontal_shift,
-            height - system.cropbox.top
-        )
-        height -= system.cropbox.height
+        merge(system, (1, 0, 0, 1, system_x, height - system_top))
+        height -= system_height
 
         # add bottom_padding
-        # dynamic_layout ? 1/3 up to max 30
-        height -= page_layout.bottom_padding + additional_bottom_padding
+        # plus 1/3 of the dynamic_spacing up to max 30
+        height -= bottom_padding
 
         # add staves
-        current_page.merge_translated_page(
-            staves,
-            (PaperSize.A4.width - staves.cropbox.width) / 2,
-            height - staves.cropbox.height,
-        )
-        height -= staves.cropbox.height
+        merge(staves, (1, 0, 0, 1, staves_x, height - staves_height))
+        height -= staves_height
 
         # add top_padding
-        # dynamic_layout ? increase 2/3 or rest
-        height -= page_layout.top_padding + additional_top_padding
+        # plus the rest of the dynamic_spacing
+        height -= top_padding
+
+    return current_page
 
 
 @app.command(rich_help_panel=True)
@@ -335,9 +422,6 @@ def run(
         typer.Option(
             "--staves",
             "-s",
-            min=0,
-            max=6,
-            clamp=True,
             help="Number of staves to add (0...6).",
             metavar="NUMBER",
             rich_help_panel="Configuration",
@@ -435,10 +519,10 @@ def run(
     Note, that a page will never be smaller than a DIN A4 page.
     """
     # read the score pdf
-    score = PdfReader(score)
+    score = PdfReader(score, strict=False)
 
-    # clean the groups
-    groups = groups_callback(score, groups)
+    # resolve the page tree only once
+    pages = list(score.pages)
 
     # create the PageLayout class
     page_layout = PageLayout(
@@ -455,32 +539,22 @@ def run(
     # the PdfWriter to build the output file
     writer = PdfWriter()
 
+    # the staves are drawn from a single Form XObject
+    stamp = create_staves_stamp(staves, writer)
+
     if groups is None:
+        # Scale the systems if they exceed the width of a DIN A4 page
+        printable_width = page_layout.printable_width
+        for system in pages:
+            if system.cropbox.width > printable_width:
+                system.scale_by(printable_width / system.cropbox.width)
+
         # Fit systems on A4 page
-        height = page_layout.top_margin + page_layout.bottom_margin
-
-        current_group_size = 0
-        groups = []
-        for system in score.pages:
-            # Scale the system if it exceeds the width of a DIN A4 page
-            if system.cropbox.width > page_layout.printable_width:
-                system.scale_by(page_layout.printable_width / system.cropbox.width)
-                
-            new_height = system.cropbox.height
-            new_height += page_layout.calculate_stave_height()
-
-            if height + new_height <= page_layout.minimum_height:
-                current_group_size += 1
-                height += new_height
-            elif height + new_height > page_layout.minimum_height and current_group_size == 0:
-                groups.append(1)
-                height = page_layout.top_margin + page_layout.bottom_margin
-            else:
-                groups.append(current_group_size)
-                height = page_layout.top_margin + page_layout.bottom_margin
-                current_group_size = 1
-
-    groups = groups_callback(score, groups)
+        groups = fit_groups([system.cropbox.height for system in pages], page_layout)
+
+    # clean the groups
+    # this adds the remaining systems to the groups found by `fit_groups`
+    groups = groups_callback(len(pages), groups)
 
     # keep track of the current system (= a page in the input score)
     current_system_number = 0
@@ -491,22 +565,15 @@ def run(
     # Follow the groupings
     for index, group in enumerate(groups):
         # get all the systems for this group
-        systems = [
-            score.pages[index]
-            for index in range(current_system_number, current_system_number + group)
-        ]
+        systems = pages[current_system_number : current_system_number + group]
 
         # increase the page number
         current_system_number += group
 
         # layout the systems
-        layout_systems(
-            systems,
-            staves,
-            writer,
-            page_layout,
-            True if index == groups_count - 1 else False
-         )
+        writer.add_page(
+            layout_systems(systems, stamp, page_layout, index == groups_count - 1)
+        )
 
     # write to disk
     print(output)
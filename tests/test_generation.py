@@ -1,5 +1,6 @@
 from pathlib import Path
 import pytest
+from pypdf import PdfReader
 from typer.testing import CliRunner
 
 from add_staves.main import app
@@ -16,7 +17,9 @@ def test_scale_down(request):
     output = Path(request.config.rootdir / "tests/output/test_scale_down.pdf")
     expectation = Path(request.config.rootdir / "tests/expectation/test_scale_down.pdf")
 
-    result = runner.invoke(app, ["--output=" + str(output), str(input)])
+    result = runner.invoke(
+        app, ["--output=" + str(output), str(input)], catch_exceptions=False
+    )
     assert result.exit_code == 0
 
     # Diff the output with the expectation
@@ -31,7 +34,9 @@ def test_zwerg_stream(request):
     output = Path(request.config.rootdir / "tests/output/test_zwerg_stream.pdf")
     expectation = Path(request.config.rootdir / "tests/expectation/test_zwerg_stream.pdf")
 
-    result = runner.invoke(app, ["--output=" + str(output), "-c='0'", str(input)])
+    result = runner.invoke(
+        app, ["--output=" + str(output), "-c='0'", str(input)], catch_exceptions=False
+    )
     assert result.exit_code == 0
 
     # Diff the output with the expectation
@@ -46,7 +51,9 @@ def test_zwerg_a4(request):
     output = Path(request.config.rootdir / "tests/output/test_zwerg_a4.pdf")
     expectation = Path(request.config.rootdir / "tests/expectation/test_zwerg_a4.pdf")
 
-    result = runner.invoke(app, ["--output=" + str(output), str(input)])
+    result = runner.invoke(
+        app, ["--output=" + str(output), str(input)], catch_exceptions=False
+    )
     assert result.exit_code == 0
 
     # Diff the output with the expectation
@@ -62,7 +69,11 @@ def test_zwerg_a4_ragged_bottom(request):
     output = Path(request.config.rootdir / "tests/output/test_zwerg_a4_ragged_bottom.pdf")
     expectation = Path(request.config.rootdir / "tests/expectation/test_zwerg_a4_ragged_bottom.pdf")
 
-    result = runner.invoke(app, ["--output=" + str(output), "--ragged-bottom", str(input)])
+    result = runner.invoke(
+        app,
+        ["--output=" + str(output), "--ragged-bottom", str(input)],
+        catch_exceptions=False,
+    )
     assert result.exit_code == 0
 
     # Diff the output with the expectation
@@ -77,7 +88,38 @@ def test_wagner_träume(request):
     output = Path(request.config.rootdir / "tests/output/test_wagner_träume.pdf")
     expectation = Path(request.config.rootdir / "tests/expectation/test_wagner_träume.pdf")
 
-    result = runner.invoke(app, ["--output=" + str(output), str(input), "--shift=-100"])
+    result = runner.invoke(
+        app, ["--output=" + str(output), str(input), "--shift=-100"], catch_exceptions=False
+    )
     assert result.exit_code == 0
 
     diff(output, expectation)
+
+
+def test_zwerg_overflowing_groups(request, tmp_path):
+    """
+    Tests that groups whose overflow lands exactly on the page count
+    don't produce an empty trailing page.
+    """
+    input = Path(request.config.rootdir / "tests/input/test_zwerg.pdf")
+    output = tmp_path / "test_zwerg_overflowing_groups.pdf"
+
+    result = runner.invoke(
+        app, ["--output=" + str(output), "-c", "2,2,5", str(input)], catch_exceptions=False
+    )
+    assert result.exit_code == 0
+
+    assert len(PdfReader(output).pages) == 2
+
+@pytest.mark.parametrize("staves", ["-1", "7"])
+def test_staves_out_of_range(request, tmp_path, staves):
+    """
+    Tests that a number of staves outside of 0...6 is rejected.
+    """
+    input = Path(request.config.rootdir / "tests/input/test_zwerg.pdf")
+    output = tmp_path / "test_staves_out_of_range.pdf"
+
+    result = runner.invoke(app, ["--output=" + str(output), "--staves=" + staves, str(input)])
+    assert result.exit_code == 2
+    assert "Valid counts are 0...6" in result.output
+    assert not output.exists()
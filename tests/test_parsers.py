@@ -0,0 +1,25 @@
+import pytest
+
+from add_staves.main import groups_parser
+
+
+@pytest.mark.parametrize(
+    "input, expectation",
+    [
+        (None, None),
+        ("", []),
+        ("3,4", [3, 4]),
+        ("3 4", [3, 4]),
+        ("1, 2 3", [1, 2, 3]),
+        ("1,,2", [1, 2]),
+        (" 3  4 ", [3, 4]),
+        ("a", []),
+        ("3 0 1", []),
+    ],
+)
+def test_groups_parser(input, expectation):
+    """
+    Tests that comma- and space-separated groups are parsed and
+    that invalid input defaults to an empty list.
+    """
+    assert groups_parser(input) == expectation